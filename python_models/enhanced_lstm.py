@@ -2,23 +2,37 @@
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import Dataset, DataLoader
 import numpy as np
-import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
 import json
 import sys
-from sklearn.preprocessing import MinMaxScaler
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
-import sqlite3
 import os
 
+# Give intra-op BLAS/OpenMP work every core; the model has no inter-op parallelism to exploit
+torch.set_num_threads(max(1, os.cpu_count() or 1))
+try:
+    torch.set_num_interop_threads(1)
+except RuntimeError:
+    # Already fixed once parallel work has started in this process
+    pass
+
+# Upper edges of the minor, light, moderate and strong magnitude bins; anything above
+# the last edge is major. float32 to match the magnitude arrays, so binning needs no upcast copy.
+MAGNITUDE_BIN_EDGES = np.array([4.0, 5.0, 6.0, 7.0], dtype=np.float32)
+
+# Inference model and its training magnitude range, loaded lazily on the first
+# prediction and reused afterwards
+_MODEL = None
+_MAGNITUDE_RANGE = None
+
 class EarthquakeLSTM(nn.Module):
     def __init__(self, input_size=1, hidden_size=128, num_layers=2, num_classes=5, dropout=0.2):
         super(EarthquakeLSTM, self).__init__()
         self.hidden_size = hidden_size
         self.num_layers = num_layers
         
-        self.lstm = nn.LSTM(input_size, hidden_size, num_layers, batch_first=True, dropout=dropout)
+        # Sequence-major (seq, batch, features) input is the LSTM kernels' native layout
+        self.lstm = nn.LSTM(input_size, hidden_size, num_layers, batch_first=False, dropout=dropout)
         self.fc1 = nn.Linear(hidden_size, 64)
         self.dropout = nn.Dropout(dropout)
         self.fc2 = nn.Linear(64, 32)
@@ -26,11 +40,9 @@ class EarthquakeLSTM(nn.Module):
         self.relu = nn.ReLU()
         
     def forward(self, x):
-        h0 = torch.zeros(self.num_layers, x.size(0), self.hidden_size)
-        c0 = torch.zeros(self.num_layers, x.size(0), self.hidden_size)
-        
-        out, _ = self.lstm(x, (h0, c0))
-        out = self.fc1(out[:, -1, :])
+        # nn.LSTM zero-initialises h0/c0 on the input's device when none are given
+        out, _ = self.lstm(x)
+        out = self.fc1(out[-1])
         out = self.relu(out)
         out = self.dropout(out)
         out = self.fc2(out)
@@ -38,139 +50,184 @@ class EarthquakeLSTM(nn.Module):
         out = self.fc3(out)
         return out
 
-class QuakeDataset(Dataset):
-    def __init__(self, X, y):
-        self.X = torch.tensor(X, dtype=torch.float32)
-        self.y = torch.tensor(y, dtype=torch.long)
-    
-    def __len__(self):
-        return len(self.X)
-    
-    def __getitem__(self, idx):
-        return self.X[idx], self.y[idx]
-
 def load_earthquake_data():
     """Load earthquake data from the database"""
     try:
-        # Connect to the database (adjust path as needed)
-        conn = sqlite3.connect(':memory:')  # Use in-memory for now
-        
-        # Mock data for demonstration - in real implementation, connect to PostgreSQL
+        # Mock data for demonstration - in real implementation, connect to PostgreSQL.
+        # Records are generated in time order; 'time' is an hourly index.
         mock_data = {
             'magnitude': np.random.normal(5.0, 1.5, 10000),
-            'time': pd.date_range('2020-01-01', periods=10000, freq='H'),
+            'time': np.arange(10000),
             'lat': np.random.uniform(-90, 90, 10000),
             'lon': np.random.uniform(-180, 180, 10000)
         }
         
-        df = pd.DataFrame(mock_data)
-        df = df[df['magnitude'] > 0]  # Remove negative magnitudes
-        
-        return df
+        keep = mock_data['magnitude'] > 0  # Remove negative magnitudes
+        return {column: values[keep] for column, values in mock_data.items()}
     except Exception as e:
         print(f"Error loading data: {e}")
         return None
 
-def prepare_sequences(df, seq_length=10):
-    """Prepare sequences for LSTM training"""
-    scaler = MinMaxScaler()
-    df_sorted = df.sort_values('time')
+def scale_magnitudes(magnitude, magnitude_range):
+    """Min-max scale magnitudes to [0, 1] using the range seen during training"""
+    mag_min, mag_max = magnitude_range
+    span = (mag_max - mag_min) or 1.0
+    return (magnitude - mag_min) / span
+
+def prepare_sequences(data, seq_length=10):
+    """Prepare sequences for LSTM training from time-ordered records"""
+    magnitude = np.asarray(data['magnitude'], dtype=np.float32)
+    
+    # Min-max scale magnitude data; the range is returned so inputs can be scaled identically
+    mag_min, mag_max = float(magnitude.min()), float(magnitude.max())
+    mag_scaled = scale_magnitudes(magnitude, (mag_min, mag_max))
+    
+    # Create magnitude bins: 0-4, 4-5, 5-6, 6-7, 7+ (right-closed intervals)
+    # minor, light, moderate, strong, major. Values below/above the edges land in the
+    # first/last bin, so no clipping is needed.
+    mag_bin = np.digitize(magnitude, MAGNITUDE_BIN_EDGES, right=True)
+    
+    # Sliding windows as a zero-copy view, dropping the last window (it has no target),
+    # laid out sequence-major as (seq_length, num_sequences, 1)
+    X = sliding_window_view(mag_scaled, seq_length)[:-1].T
+    y = mag_bin[seq_length:]
     
-    # Scale magnitude data
-    mag_scaled = scaler.fit_transform(df_sorted['magnitude'].values.reshape(-1, 1))
+    return np.ascontiguousarray(X)[:, :, np.newaxis], y, (mag_min, mag_max)
+
+def classification_metrics(y_true, y_pred, num_classes=5):
+    """Accuracy and support-weighted precision/recall/F1 from a single confusion matrix"""
+    cm = torch.bincount(y_true * num_classes + y_pred, minlength=num_classes ** 2)
+    cm = cm.reshape(num_classes, num_classes).double()
     
-    # Create magnitude bins
-    bins = [0, 4, 5, 6, 7, np.inf]
-    labels = [0, 1, 2, 3, 4]  # minor, light, moderate, strong, major
-    df_sorted['mag_bin'] = pd.cut(df_sorted['magnitude'], bins=bins, labels=labels, include_lowest=True).cat.codes
+    tp = cm.diagonal()
+    support = cm.sum(dim=1)
+    predicted = cm.sum(dim=0)
     
-    X, y = [], []
-    for i in range(len(mag_scaled) - seq_length):
-        X.append(mag_scaled[i:i+seq_length].flatten())
-        y.append(df_sorted['mag_bin'].iloc[i+seq_length])
+    # Undefined ratios count as 0, matching sklearn's zero_division=0
+    precision = torch.where(predicted > 0, tp / predicted.clamp(min=1), torch.zeros_like(tp))
+    recall = torch.where(support > 0, tp / support.clamp(min=1), torch.zeros_like(tp))
+    denom = precision + recall
+    f1 = torch.where(denom > 0, 2 * precision * recall / denom.clamp(min=1e-12), torch.zeros_like(tp))
     
-    return np.array(X).reshape(-1, seq_length, 1), np.array(y), scaler
+    weights = support / support.sum()
+    metrics = torch.stack([
+        tp.sum() / support.sum(),
+        (precision * weights).sum(),
+        (recall * weights).sum(),
+        (f1 * weights).sum(),
+    ])
+    return tuple(metrics.tolist())
 
 def train_model():
     """Enhanced training function based on the provided script"""
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    
     print("Loading earthquake data...")
-    df = load_earthquake_data()
-    if df is None:
+    data = load_earthquake_data()
+    if data is None:
         return {"error": "Failed to load data"}
     
     # Prepare sequences
-    X, y, scaler = prepare_sequences(df)
+    X, y, magnitude_range = prepare_sequences(data)
     
     # Split data - emphasize post-2020 for validation
-    split_idx = int(len(X) * 0.8)
-    X_train, X_val = X[:split_idx], X[split_idx:]
+    split_idx = int(len(y) * 0.8)
+    X_train, X_val = X[:, :split_idx], X[:, split_idx:]
     y_train, y_val = y[:split_idx], y[split_idx:]
     
-    # Create datasets
-    train_dataset = QuakeDataset(X_train, y_train)
-    val_dataset = QuakeDataset(X_val, y_val)
-    
-    train_loader = DataLoader(train_dataset, batch_size=64, shuffle=True)
-    val_loader = DataLoader(val_dataset, batch_size=64)
+    # The whole dataset is a few MB, so keep it resident on the device and batch by
+    # slicing; the validation set is small enough to score in a single batch
+    batch_size = 64
+    X_train_t = torch.from_numpy(X_train).float().to(device)
+    y_train_t = torch.from_numpy(y_train).long().to(device)
+    X_val_t = torch.from_numpy(X_val).float().to(device)
+    y_val_t = torch.from_numpy(y_val).long().to(device)
     
     # Initialize model
-    model = EarthquakeLSTM()
+    model = EarthquakeLSTM().to(device)
+    # CUDA graphs remove per-step launch overhead for the small fixed-size batches; on the
+    # CPU compiling is no faster than eager for this model. The eager module is still used
+    # for validation and checkpoints, so saved keys are unchanged.
+    train_net = torch.compile(model, mode='reduce-overhead') if device.type == 'cuda' else model
     
     # Dynamic class weights (heavy FN penalty for major quakes)
-    class_counts = np.bincount(y_train)
-    class_weights = 1.0 / (class_counts + 1e-6)
+    # minlength keeps one weight per class even if a bin is absent from the training split
+    class_counts = np.bincount(y_train, minlength=5).astype(np.float32)
     # Amplify weights for major earthquakes (bins 3 and 4)
-    class_weights = class_weights * np.array([1.0, 1.2, 1.5, 2.0, 3.0])
-    class_weights = torch.tensor(class_weights / class_weights.sum(), dtype=torch.float32)
+    class_weights = (1.0 / (class_counts + 1e-6)) * np.array([1.0, 1.2, 1.5, 2.0, 3.0], dtype=np.float32)
+    class_weights = torch.from_numpy(class_weights / class_weights.sum()).to(device)
     
     criterion = nn.CrossEntropyLoss(weight=class_weights)
     optimizer = optim.Adam(model.parameters(), lr=0.001, weight_decay=1e-5)
     scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, patience=5, factor=0.5)
     
-    # Training loop with recall target
+    # Mixed precision only on CUDA; on the CPU both wrappers are no-ops
+    use_amp = device.type == 'cuda'
+    grad_scaler = torch.amp.GradScaler(device.type, enabled=use_amp)
+    
+    # Training loop with recall target, stopping early once recall plateaus
     model.train()
     recall = 0.0
     epoch = 0
     best_recall = 0.0
+    patience = 10
+    stale_epochs = 0
     
     while recall < 0.95 and epoch < 100:  # Prevent infinite loop
-        epoch_loss = 0
-        for batch_idx, (data, target) in enumerate(train_loader):
+        # Accumulate on-device and sync once per epoch rather than per batch
+        epoch_loss_t = torch.zeros((), device=device)
+        # Shuffle by index and drop the last partial batch so every batch has the same
+        # shape and a compiled model is not re-captured
+        perm = torch.randperm(len(y_train_t), device=device)
+        for start in range(0, len(perm) - batch_size + 1, batch_size):
+            idx = perm[start:start + batch_size]
+            data, target = X_train_t[:, idx], y_train_t[idx]
             optimizer.zero_grad()
-            output = model(data)
-            loss = criterion(output, target)
-            loss.backward()
-            optimizer.step()
-            epoch_loss += loss.item()
+            with torch.autocast(device.type, enabled=use_amp):
+                output = train_net(data)
+                loss = criterion(output, target)
+            grad_scaler.scale(loss).backward()
+            grad_scaler.step(optimizer)
+            grad_scaler.update()
+            epoch_loss_t += loss.detach()
+        epoch_loss = epoch_loss_t.item()
         
         # Validation
         model.eval()
-        val_preds, val_actuals = [], []
-        with torch.no_grad():
-            for data, target in val_loader:
-                output = model(data)
-                pred = output.argmax(dim=1)
-                val_preds.extend(pred.cpu().numpy())
-                val_actuals.extend(target.cpu().numpy())
-        
-        # Calculate metrics
-        accuracy = accuracy_score(val_actuals, val_preds)
-        precision = precision_score(val_actuals, val_preds, average='weighted', zero_division=0)
-        recall = recall_score(val_actuals, val_preds, average='weighted', zero_division=0)
-        f1 = f1_score(val_actuals, val_preds, average='weighted', zero_division=0)
+        with torch.inference_mode():
+            val_preds = model(X_val_t).argmax(dim=1)
+            
+            # Calculate metrics
+            accuracy, precision, recall, f1 = classification_metrics(y_val_t, val_preds)
         
         scheduler.step(epoch_loss)
         
-        if recall > best_recall:
+        if recall > best_recall + 1e-4:
             best_recall = recall
-            # Save best model
-            torch.save(model.state_dict(), 'best_earthquake_model.pth')
+            stale_epochs = 0
+            # Save best model with the scaling range needed at prediction time
+            torch.save({
+                'model_state_dict': model.state_dict(),
+                'magnitude_min': magnitude_range[0],
+                'magnitude_max': magnitude_range[1]
+            }, 'best_earthquake_model.pth')
+        else:
+            stale_epochs += 1
         
         model.train()
         epoch += 1
         
         if epoch % 10 == 0:
             print(f"Epoch {epoch}: Loss: {epoch_loss:.4f}, Acc: {accuracy:.3f}, Precision: {precision:.3f}, Recall: {recall:.3f}, F1: {f1:.3f}")
+        
+        if stale_epochs >= patience:
+            print(f"Early stopping at epoch {epoch}: recall has not improved on {best_recall:.3f} for {patience} epochs")
+            break
+    
+    # Drop any cached inference model so the next prediction loads the new weights
+    global _MODEL, _MAGNITUDE_RANGE
+    _MODEL = None
+    _MAGNITUDE_RANGE = None
     
     return {
         "training_completed": True,
@@ -183,21 +240,56 @@ def train_model():
         }
     }
 
+def load_inference_model(model_path='best_earthquake_model.pth', seq_length=10):
+    """Load the trained weights as a frozen TorchScript module for inference.
+    
+    Returns the module and the (min, max) magnitude range used to scale its
+    training data, or None for older checkpoints that stored only weights.
+    """
+    checkpoint = torch.load(model_path, map_location='cpu')
+    if 'model_state_dict' in checkpoint:
+        state_dict = checkpoint['model_state_dict']
+        magnitude_range = (checkpoint['magnitude_min'], checkpoint['magnitude_max'])
+    else:
+        state_dict = checkpoint
+        magnitude_range = None
+    
+    model = EarthquakeLSTM()
+    model.load_state_dict(state_dict)
+    model.eval()
+    
+    # int8 dynamic quantization of the LSTM and FC head; weights are quantized once here,
+    # activations per call
+    model = torch.ao.quantization.quantize_dynamic(model, {nn.LSTM, nn.Linear}, dtype=torch.qint8)
+    
+    scripted = torch.jit.optimize_for_inference(torch.jit.script(model))
+    
+    # Warm up once so JIT profiling/fusion happens before the first real prediction
+    with torch.jit.optimized_execution(True), torch.inference_mode():
+        scripted(torch.zeros(seq_length, 1, 1))
+    
+    return scripted, magnitude_range
+
 def predict_magnitude(sequence_data):
     """Make magnitude predictions using the trained model"""
+    global _MODEL, _MAGNITUDE_RANGE
     try:
-        model = EarthquakeLSTM()
-        model.load_state_dict(torch.load('best_earthquake_model.pth'))
-        model.eval()
+        if _MODEL is None:
+            _MODEL, _MAGNITUDE_RANGE = load_inference_model()
+        
+        # Scale raw magnitudes like the training data and shape as (seq, batch=1, features=1)
+        sequence = np.asarray(sequence_data, dtype=np.float32)
+        if _MAGNITUDE_RANGE is not None:
+            sequence = scale_magnitudes(sequence, _MAGNITUDE_RANGE)
+        input_tensor = torch.from_numpy(sequence).reshape(-1, 1, 1)
         
-        # Convert input to tensor
-        input_tensor = torch.tensor(sequence_data, dtype=torch.float32).unsqueeze(0)
+        with torch.inference_mode():
+            output = _MODEL(input_tensor)
+            probabilities = output.softmax(dim=-1)[0].cpu()
+            confidence, predicted_bin = probabilities.max(dim=0)
         
-        with torch.no_grad():
-            output = model(input_tensor)
-            probabilities = torch.softmax(output, dim=1)
-            predicted_bin = output.argmax(dim=1).item()
-            confidence = probabilities.max().item()
+        predicted_bin = int(predicted_bin)
+        confidence = float(confidence)
         
         # Map bin to magnitude range
         magnitude_ranges = {
@@ -218,7 +310,7 @@ def predict_magnitude(sequence_data):
         return {
             "magnitudeBin": predicted_bin,
             "confidence": float(confidence),
-            "probabilityDistribution": probabilities[0].tolist(),
+            "probabilityDistribution": probabilities.tolist(),
             "expectedMagnitude": float(expected_magnitude),
             "riskLevel": risk_level,
             "magnitudeRange": mag_range